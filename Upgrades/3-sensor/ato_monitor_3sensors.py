@@ -16,12 +16,22 @@ Complete aquarium Auto Top-Off monitoring system with:
 
 import paho.mqtt.client as mqtt
 import RPi.GPIO as GPIO
+import numpy as np
 import time
 from datetime import datetime, timedelta
 import json
 import pickle
+import msgpack
 import os
 import glob
+import struct
+import mmap
+import atexit
+import signal
+import sys
+import threading
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 
 # Import configuration
 try:
@@ -41,6 +51,12 @@ GPIO.output(PUMP_PIN, GPIO.HIGH)  # Start with pump OFF
 client = mqtt.Client()
 client.username_pw_set(MQTT_USER, MQTT_PASS)
 
+# Publishes are queued and sent by paho's network thread (started with
+# client.loop_start() in main() once handlers are attached) so a slow broker
+# never stalls sensor reads or pump control
+client.max_inflight_messages_set(20)
+client.max_queued_messages_set(1000)
+
 try:
     client.connect(MQTT_BROKER, MQTT_PORT, 60)
 except Exception as e:
@@ -80,38 +96,107 @@ pump_performance_history = []
 # TEMPERATURE SENSOR CONFIGURATION (3 SENSORS)
 # ============================================================================
 
+def epoch_now():
+    """Current time as whole epoch seconds (cheaper than building a datetime)"""
+    return int(time.time())
+
+# Keep last 10,000 readings per sensor (oldest overwritten automatically)
+TEMP_HISTORY_MAXLEN = 10000
+
+# One packed 9-byte record per reading (vs ~400 bytes as a dict with an ISO string)
+TEMP_HISTORY_DTYPE = np.dtype([('ts', 'u4'),      # Epoch seconds
+                               ('temp', 'f4'),    # °C
+                               ('season', 'u1')]) # SEASON_NAMES index
+
+def new_temp_history():
+    """Create an empty ring buffer of temperature readings"""
+    return {
+        'records': np.empty(TEMP_HISTORY_MAXLEN, dtype=TEMP_HISTORY_DTYPE),
+        'next': 0,  # Slot the next reading is written to
+        'count': 0
+    }
+
+def temp_history_append(history, ts_epoch, temp, season_idx):
+    """Add a reading to a ring buffer, overwriting the oldest when full"""
+    slot = history['next']
+    history['records'][slot] = (ts_epoch, temp, season_idx)
+    history['next'] = (slot + 1) % TEMP_HISTORY_MAXLEN
+    history['count'] = min(history['count'] + 1, TEMP_HISTORY_MAXLEN)
+
+def temp_history_ordered(history):
+    """Return the readings in a ring buffer, oldest first"""
+    records = history['records']
+    if history['count'] < TEMP_HISTORY_MAXLEN:
+        return records[:history['count']]
+    return np.concatenate((records[history['next']:], records[:history['next']]))
+
 temp_sensors = {
     'display': {
         'id': None,
+        'hw_id': None,  # 1-Wire ID, e.g. 28-0316a2799aff
         'name': 'Display Tank',
         'current_temp': None,
         'raw_temp': None,
         'calibration_offset': 0.0,
-        'history': [],
+        'fd': None,  # Cached w1_slave file handle
+        'resolution_step': 0.0625,  # °C per count, read back from the sensor
+        'last_recorded_temp': None,
+        'last_recorded_at': None,  # time.monotonic() of last recorded reading
+        'history': new_temp_history(),
         'alerts_enabled': True  # Critical alerts enabled
     },
     'sump': {
         'id': None,
+        'hw_id': None,  # 1-Wire ID, e.g. 28-0316a2799aff
         'name': 'Sump',
         'current_temp': None,
         'raw_temp': None,
         'calibration_offset': 0.0,
-        'history': [],
+        'fd': None,  # Cached w1_slave file handle
+        'resolution_step': 0.0625,  # °C per count, read back from the sensor
+        'last_recorded_temp': None,
+        'last_recorded_at': None,  # time.monotonic() of last recorded reading
+        'history': new_temp_history(),
         'alerts_enabled': True  # Critical alerts enabled
     },
     'ato': {
         'id': None,
+        'hw_id': None,  # 1-Wire ID, e.g. 28-0316a2799aff
         'name': 'ATO Reservoir',
         'current_temp': None,
         'raw_temp': None,
         'calibration_offset': 0.0,
-        'history': [],
+        'fd': None,  # Cached w1_slave file handle
+        'resolution_step': 0.0625,  # °C per count, read back from the sensor
+        'last_recorded_temp': None,
+        'last_recorded_at': None,  # time.monotonic() of last recorded reading
+        'history': new_temp_history(),
         'alerts_enabled': False  # Informational only
     }
 }
 
 last_temp_alert = {}
 
+# Temperature history is written by the polling thread and read by the main loop
+temp_lock = threading.Lock()
+
+# Sensor assignment settings (optional in config.py)
+AUTO_DETECT_SENSORS = globals().get('AUTO_DETECT_SENSORS', True)
+MANUAL_IDS = {key: globals().get(f'TEMP_SENSOR_{key.upper()}_ID') for key in temp_sensors}
+
+# 1-Wire bus master sysfs directory (bulk conversion trigger lives here)
+W1_BUS_MASTER = '/sys/bus/w1/devices/w1_bus_master1'
+BULK_READ_ENABLED = globals().get('BULK_READ_ENABLED', False)
+DS18B20_RESOLUTION = globals().get('DS18B20_RESOLUTION', 12)
+
+if DS18B20_RESOLUTION not in (9, 10, 11, 12):
+    print(f"⚠️  Invalid DS18B20_RESOLUTION {DS18B20_RESOLUTION} (must be 9-12), using 12-bit")
+    DS18B20_RESOLUTION = 12
+
+# Each w1_slave read blocks for the sensor's conversion time; reading the
+# sensors on separate threads lets the conversions overlap
+temp_read_executor = ThreadPoolExecutor(max_workers=len(temp_sensors))
+
 # ============================================================================
 # TEMPERATURE SENSOR FUNCTIONS (MULTI-SENSOR)
 # ============================================================================
@@ -130,21 +215,16 @@ def find_all_temp_sensors():
         print(f"🔍 Found {len(all_sensors)} DS18B20 sensor(s)")
         
         # Check if we should auto-detect or use manual IDs
-        if hasattr(globals().get('config'), 'AUTO_DETECT_SENSORS') and AUTO_DETECT_SENSORS:
+        if AUTO_DETECT_SENSORS:
             # Auto-detection mode
             all_sensors.sort()  # Sort alphabetically by ID
             
-            if len(all_sensors) >= 1:
-                temp_sensors['display']['id'] = all_sensors[0]
-                print(f"   Display Tank: {all_sensors[0].split('/')[-1]}")
-            
-            if len(all_sensors) >= 2:
-                temp_sensors['sump']['id'] = all_sensors[1]
-                print(f"   Sump: {all_sensors[1].split('/')[-1]}")
-            
-            if len(all_sensors) >= 3:
-                temp_sensors['ato']['id'] = all_sensors[2]
-                print(f"   ATO Reservoir: {all_sensors[2].split('/')[-1]}")
+            # Assign in order: Display Tank, Sump, ATO Reservoir
+            for sensor_key, full_path in zip(('display', 'sump', 'ato'), all_sensors):
+                sensor_data = temp_sensors[sensor_key]
+                sensor_data['id'] = full_path
+                sensor_data['hw_id'] = os.path.basename(full_path)
+                print(f"   {sensor_data['name']}: {sensor_data['hw_id']}")
             
             if len(all_sensors) < 3:
                 print(f"⚠️  Only {len(all_sensors)} sensor(s) detected (system supports 3)")
@@ -153,21 +233,29 @@ def find_all_temp_sensors():
         else:
             # Manual configuration mode
             for sensor_key, sensor_data in temp_sensors.items():
-                config_id_key = f'TEMP_SENSOR_{sensor_key.upper()}_ID'
-                if hasattr(globals().get('config'), config_id_key):
-                    manual_id = getattr(globals().get('config'), config_id_key)
-                    
+                manual_id = MANUAL_IDS[sensor_key]
+                if manual_id:
                     # Find full path
                     for full_path in all_sensors:
-                        if manual_id in full_path:
+                        hw_id = os.path.basename(full_path)
+                        if manual_id in hw_id:
                             sensor_data['id'] = full_path
-                            print(f"   {sensor_data['name']}: {manual_id}")
+                            sensor_data['hw_id'] = hw_id
+                            print(f"   {sensor_data['name']}: {hw_id}")
                             break
         
         # Verify at least one sensor found
         sensors_found = sum(1 for s in temp_sensors.values() if s['id'] is not None)
         if sensors_found > 0:
             print(f"✅ Configured {sensors_found} temperature sensor(s)")
+            set_sensor_resolutions()
+            
+            for sensor_data in temp_sensors.values():
+                if sensor_data['id']:
+                    try:
+                        open_sensor_file(sensor_data)
+                    except OSError as e:
+                        print(f"⚠️  Could not open {sensor_data['name']} sensor: {e}")
             return True
         else:
             print("⚠️  No temperature sensors configured")
@@ -177,45 +265,150 @@ def find_all_temp_sensors():
         print(f"⚠️  Error detecting temperature sensors: {e}")
         return False
 
-def read_temp_raw_from_sensor(sensor_path):
-    """Read raw data from a specific temperature sensor"""
-    if not sensor_path:
-        return None
+def set_sensor_resolutions():
+    """Apply DS18B20_RESOLUTION to all configured sensors (shorter conversions)"""
+    for sensor_data in temp_sensors.values():
+        if not sensor_data['id']:
+            continue
+        try:
+            with open(sensor_data['id'] + '/resolution', 'w') as f:
+                f.write(f"{DS18B20_RESOLUTION}\n")
+        except Exception as e:
+            print(f"⚠️  Could not set {sensor_data['name']} resolution to {DS18B20_RESOLUTION}-bit: {e}")
+        
+        # The write needs root, so check what the sensor is actually using
+        bits = read_sensor_resolution(sensor_data)
+        if bits is None:
+            continue
+        sensor_data['resolution_step'] = 0.0625 * 2 ** (12 - bits)
+        if bits != DS18B20_RESOLUTION:
+            print(f"   {sensor_data['name']} is using {bits}-bit resolution")
+
+def read_sensor_resolution(sensor_data):
+    """Read a sensor's current resolution in bits (None if unavailable)"""
     try:
-        with open(sensor_path + '/w1_slave', 'r') as f:
-            return f.readlines()
+        with open(sensor_data['id'] + '/resolution', 'r') as f:
+            bits = int(f.read())
     except Exception as e:
         return None
+    return bits if 9 <= bits <= 12 else None
+
+def quantize_temperature(temp_c, sensor_data):
+    """Round a reading to the sensor's resolution step"""
+    step = sensor_data['resolution_step']
+    return round(round(temp_c / step) * step, 2)
+
+def open_sensor_file(sensor_data):
+    """Open a sensor's w1_slave file and keep it open for repeated reads"""
+    close_sensor_file(sensor_data)
+    sensor_data['fd'] = open(sensor_data['id'] + '/w1_slave', 'rb', buffering=0)
+    return sensor_data['fd']
+
+def close_sensor_file(sensor_data):
+    """Close a sensor's cached w1_slave file, if open"""
+    if sensor_data['fd'] is not None:
+        try:
+            sensor_data['fd'].close()
+        except Exception as e:
+            pass
+        sensor_data['fd'] = None
+
+def read_temp_raw_from_sensor(sensor_data):
+    """Read raw data from a specific temperature sensor"""
+    if not sensor_data['id']:
+        return None
+    try:
+        fd = sensor_data['fd'] or open_sensor_file(sensor_data)
+        fd.seek(0)  # sysfs regenerates the reading on each read from offset 0
+        return fd.read()
+    except (OSError, ValueError):
+        # Transient bus error, sensor re-plugged or handle closed - reopen once and retry
+        try:
+            return open_sensor_file(sensor_data).read()
+        except Exception as e:
+            close_sensor_file(sensor_data)
+            return None
 
-def read_temperature_from_sensor(sensor_path):
+def read_temperature_from_sensor(sensor_data):
     """Read temperature from a specific DS18B20 sensor"""
-    lines = read_temp_raw_from_sensor(sensor_path)
-    if not lines:
+    raw = read_temp_raw_from_sensor(sensor_data)
+    if not raw:
         return None
     
-    if lines[0].strip()[-3:] != 'YES':
+    # Line 1 ends with the CRC check result: "... crc=57 YES"
+    crc_end = raw.find(b'\n')
+    if crc_end < 3 or raw[crc_end - 3:crc_end] != b'YES':
         return None
     
-    equals_pos = lines[1].find('t=')
-    if equals_pos != -1:
-        temp_string = lines[1][equals_pos + 2:]
-        temp_c = float(temp_string) / 1000.0
-        return round(temp_c, 2)
+    # Line 2 ends with the reading in millidegrees: "... t=23125"
+    equals_pos = raw.rfind(b't=')
+    if equals_pos == -1:
+        return None
     
-    return None
+    try:
+        return quantize_temperature(int(raw[equals_pos + 2:]) / 1000.0, sensor_data)
+    except ValueError:
+        return None
 
-def read_all_temperatures():
-    """Read all temperature sensors with calibration applied"""
-    for sensor_key, sensor_data in temp_sensors.items():
-        if not sensor_data['id']:
-            continue
-        
-        raw_temp = read_temperature_from_sensor(sensor_data['id'])
+def trigger_bulk_conversion():
+    """Start one temperature conversion on every sensor on the bus"""
+    global BULK_READ_ENABLED
+    
+    bulk_read_path = W1_BUS_MASTER + '/therm_bulk_read'
+    try:
+        with open(bulk_read_path, 'w') as f:
+            f.write('trigger\n')
+    except OSError as e:
+        # Not running as root, or the kernel lacks therm_bulk_read - stop trying
+        print(f"⚠️  Bulk temperature read unavailable, using per-sensor reads: {e}")
+        BULK_READ_ENABLED = False
+        return False
+    
+    try:
+        # -1 while any sensor is still converting (750ms max at 12-bit)
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            with open(bulk_read_path, 'r') as f:
+                if f.read().strip() != '-1':
+                    return True
+            time.sleep(0.05)
         
+        return False
+    except Exception as e:
+        return False
+
+def read_bulk_temperature_from_sensor(sensor_data):
+    """Read the value converted by the last bulk trigger (no new conversion)"""
+    if not sensor_data['id']:
+        return None
+    try:
+        with open(sensor_data['id'] + '/temperature', 'r') as f:
+            return quantize_temperature(int(f.read()) / 1000.0, sensor_data)
+    except Exception as e:
+        return None
+
+def read_all_temperatures():
+    """Read all temperature sensors in parallel with calibration applied
+    
+    Returns the keys of the sensors that gave a valid reading.
+    """
+    active_keys = [key for key, s in temp_sensors.items() if s['id']]
+    active_sensors = [temp_sensors[key] for key in active_keys]
+    
+    if BULK_READ_ENABLED and trigger_bulk_conversion():
+        raw_temps = [read_bulk_temperature_from_sensor(s) for s in active_sensors]
+    else:
+        raw_temps = temp_read_executor.map(read_temperature_from_sensor, active_sensors)
+    
+    updated = []
+    for sensor_key, sensor_data, raw_temp in zip(active_keys, active_sensors, raw_temps):
         if raw_temp is not None:
             sensor_data['raw_temp'] = raw_temp
             calibrated_temp = raw_temp + sensor_data['calibration_offset']
             sensor_data['current_temp'] = round(calibrated_temp, 2)
+            updated.append(sensor_key)
+    
+    return updated
 
 def set_temp_calibration_offset(sensor_key, offset):
     """Set temperature calibration offset for a specific sensor"""
@@ -230,66 +423,69 @@ def set_temp_calibration_offset(sensor_key, offset):
         print(f"⚠️  Calibration offset too large: {offset}°C (limit: ±5°C)")
         return
     
-    temp_sensors[sensor_key]['calibration_offset'] = offset
-    save_temp_calibration()
+    sensor_data = temp_sensors[sensor_key]
+    sensor_data['calibration_offset'] = offset
+    save_state()
+    
+    # Re-apply to the last reading and record it on the next poll, however small the change
+    if sensor_data['raw_temp'] is not None:
+        sensor_data['current_temp'] = round(sensor_data['raw_temp'] + offset, 2)
+    sensor_data['last_recorded_temp'] = None
     
-    # Publish updated offset
-    client.publish(f"aquarium/temp/{sensor_key}_calibration", offset)
-    print(f"🌡️  {temp_sensors[sensor_key]['name']} calibration offset set to: {offset}°C")
+    # Publish updated offset and calibrated temperature
+    publish_if_changed(f"aquarium/temp/{sensor_key}_calibration", offset)
+    publish_state()
+    print(f"🌡️  {sensor_data['name']} calibration offset set to: {offset}°C")
 
 def record_temperature(sensor_key, temp):
     """Record a temperature reading for a specific sensor"""
+    global temp_history_dirty
+    
     if sensor_key not in temp_sensors:
         return
     
-    temp_record = {
-        'timestamp': datetime.now().isoformat(),
-        'temperature': temp,
-        'season': get_current_season()
-    }
-    
-    temp_sensors[sensor_key]['history'].append(temp_record)
+    ts_epoch = epoch_now()
+    season_idx = SEASON_NAMES.index(get_current_season())
     
-    # Keep last 10,000 readings per sensor
-    if len(temp_sensors[sensor_key]['history']) > 10000:
-        temp_sensors[sensor_key]['history'].pop(0)
+    with temp_lock:
+        temp_history_append(temp_sensors[sensor_key]['history'], ts_epoch, temp, season_idx)
+        append_temp_log(sensor_key, ts_epoch, temp, season_idx)
+        temp_history_dirty = True
+
+def window_temp_stats(ts, temps, since_ts):
+    """Return (avg, min, max) of readings at or after since_ts, or Nones if none"""
+    window = temps[np.searchsorted(ts, since_ts):]
+    if window.size == 0:
+        return None, None, None
     
-    save_temp_history()
+    return (round(float(window.mean(dtype=np.float64)), 2),
+            round(float(window.min()), 2),
+            round(float(window.max()), 2))
 
 def calculate_temp_stats(sensor_key):
     """Calculate temperature statistics for a specific sensor"""
     if sensor_key not in temp_sensors:
         return None
     
-    history = temp_sensors[sensor_key]['history']
-    
-    if not history:
-        return {
-            'avg_24h': None,
-            'min_24h': None,
-            'max_24h': None,
-            'avg_7d': None,
-            'min_7d': None,
-            'max_7d': None
-        }
-    
-    now = datetime.now()
-    day_ago = now - timedelta(hours=24)
-    week_ago = now - timedelta(days=7)
+    now_ts = epoch_now()
+    day_ago = now_ts - 86400
+    week_ago = now_ts - 604800
     
-    temps_24h = [r['temperature'] for r in history 
-                 if datetime.fromisoformat(r['timestamp']) >= day_ago]
-    
-    temps_7d = [r['temperature'] for r in history 
-                if datetime.fromisoformat(r['timestamp']) >= week_ago]
+    with temp_lock:
+        records = temp_history_ordered(temp_sensors[sensor_key]['history'])
+        ts = records['ts']
+        temps = records['temp']
+        
+        avg_24h, min_24h, max_24h = window_temp_stats(ts, temps, day_ago)
+        avg_7d, min_7d, max_7d = window_temp_stats(ts, temps, week_ago)
     
     return {
-        'avg_24h': round(sum(temps_24h) / len(temps_24h), 2) if temps_24h else None,
-        'min_24h': round(min(temps_24h), 2) if temps_24h else None,
-        'max_24h': round(max(temps_24h), 2) if temps_24h else None,
-        'avg_7d': round(sum(temps_7d) / len(temps_7d), 2) if temps_7d else None,
-        'min_7d': round(min(temps_7d), 2) if temps_7d else None,
-        'max_7d': round(max(temps_7d), 2) if temps_7d else None
+        'avg_24h': avg_24h,
+        'min_24h': min_24h,
+        'max_24h': max_24h,
+        'avg_7d': avg_7d,
+        'min_7d': min_7d,
+        'max_7d': max_7d
     }
 
 def calculate_temp_difference():
@@ -306,19 +502,17 @@ def calculate_temp_difference():
 # SEASONAL TRACKING FUNCTIONS
 # ============================================================================
 
+# Season for each month (Northern Hemisphere), indexed by month number
+MONTH_TO_SEASON = (None,
+                   "Winter", "Winter", "Spring", "Spring", "Spring", "Summer",
+                   "Summer", "Summer", "Autumn", "Autumn", "Autumn", "Winter")
+
+# Season index used in the binary temperature log
+SEASON_NAMES = ("Winter", "Spring", "Summer", "Autumn")
+
 def get_current_season():
     """Determine current season based on date (Northern Hemisphere)"""
-    now = datetime.now()
-    month = now.month
-    
-    if month in [12, 1, 2]:
-        return "Winter"
-    elif month in [3, 4, 5]:
-        return "Spring"
-    elif month in [6, 7, 8]:
-        return "Summer"
-    elif month in [9, 10, 11]:
-        return "Autumn"
+    return MONTH_TO_SEASON[datetime.now().month]
 
 def get_season_emoji():
     """Get emoji for current season"""
@@ -342,20 +536,15 @@ def calculate_seasonal_stats():
     
     year_ago = datetime.now() - timedelta(days=365)
     
-    for activation_time in activation_history:
-        if activation_time >= year_ago:
-            month = activation_time.month
-            if month in [12, 1, 2]:
-                season = "Winter"
-            elif month in [3, 4, 5]:
-                season = "Spring"
-            elif month in [6, 7, 8]:
-                season = "Summer"
-            else:
-                season = "Autumn"
-            
-            seasonal_data[season]["activations"] += 1
-            seasonal_data[season]["liters"] += LITERS_PER_ACTIVATION
+    # activation_history is chronological - skip straight to the last year
+    start = bisect_left(activation_history, year_ago)
+    
+    # The main loop prunes activation_history to 30 days, so a plain loop is
+    # cheap (~1.5ms) - building a numpy array per call measured far slower
+    for activation_time in activation_history[start:]:
+        season = MONTH_TO_SEASON[activation_time.month]
+        seasonal_data[season]["activations"] += 1
+        seasonal_data[season]["liters"] += LITERS_PER_ACTIVATION
     
     for season in seasonal_data:
         days = seasonal_data[season]["days"]
@@ -365,4 +554,396 @@ def calculate_seasonal_stats():
     
     return seasonal_data
 
+# ============================================================================
+# MQTT PUBLISHING FUNCTIONS
+# ============================================================================
+
+def build_state_payload():
+    """Build the combined state message for one publish cycle"""
+    return {
+        "temps": {key: s['current_temp'] for key, s in temp_sensors.items()},
+        "raw": {key: s['raw_temp'] for key, s in temp_sensors.items()},
+        "offsets": {key: s['calibration_offset'] for key, s in temp_sensors.items()},
+        "stats": {key: calculate_temp_stats(key) for key in temp_sensors},
+        "display_sump_diff": calculate_temp_difference()
+    }
+
+# Last payload sent on each retained topic
+last_published = {}
+
+def publish_if_changed(topic, value, force=False):
+    """Publish a retained value only if it differs from the last one sent (or force)"""
+    if not force and last_published.get(topic) == value:
+        return False
+    
+    result = client.publish(topic, value, qos=0, retain=True)
+    if result.rc != mqtt.MQTT_ERR_SUCCESS:
+        return False  # Not cached, so the next call retries
+    
+    last_published[topic] = value
+    return True
+
+def publish_state(force=False):
+    """Publish all temperature state as a single retained message"""
+    payload = build_state_payload()
+    publish_if_changed("aquarium/state", json.dumps(payload), force)
+    publish_ato_compat_topics(payload, force)
+
+def publish_ato_compat_topics(payload, force=False):
+    """Keep the original single-sensor ATO topics updated for existing HA entities"""
+    if payload["temps"]["ato"] is None:
+        return
+    
+    publish_if_changed("aquarium/ato/temperature", payload["temps"]["ato"], force)
+    publish_if_changed("aquarium/ato/temperature_raw", payload["raw"]["ato"], force)
+    publish_if_changed("aquarium/ato/temp_stats", json.dumps(payload["stats"]["ato"]), force)
+
+def publish_calibration_offsets():
+    """Publish every sensor's calibration offset (e.g. at startup for HA)"""
+    for sensor_key, sensor_data in temp_sensors.items():
+        publish_if_changed(f"aquarium/temp/{sensor_key}_calibration", sensor_data['calibration_offset'])
+
+# ============================================================================
+# FILE I/O FUNCTIONS (TEMPERATURE)
+# ============================================================================
+
+# Temperature history is kept in one circular binary log per sensor:
+#   header: next slot to write, number of stored readings   (<II)
+#   slots:  TEMP_HISTORY_MAXLEN x (ts_epoch, temperature, season index)  (<dfB)
+# Each reading overwrites one fixed-size slot, so saving is O(1)
+TEMP_LOG_HEADER = struct.Struct('<II')
+TEMP_LOG_RECORD = struct.Struct('<dfB')
+TEMP_LOG_DTYPE = np.dtype([('ts', '<f8'), ('temp', '<f4'), ('season', 'u1')])  # Same layout
+
+temp_log_files = {}
+
+def temp_log_path(sensor_key):
+    """Binary log file path for a sensor, next to TEMP_HISTORY_FILE"""
+    return f"{os.path.splitext(TEMP_HISTORY_FILE)[0]}_{sensor_key}.bin"
+
+def set_sensor_history(sensor_data, ts, temps, seasons):
+    """Replace a sensor's history with the given readings (oldest first)"""
+    history = new_temp_history()
+    count = min(len(ts), TEMP_HISTORY_MAXLEN)
+    
+    if count:
+        records = history['records']
+        records['ts'][:count] = np.asarray(ts[-count:], dtype=np.float64).astype(np.uint32)
+        records['temp'][:count] = temps[-count:]
+        records['season'][:count] = seasons[-count:]
+    
+    history['next'] = count % TEMP_HISTORY_MAXLEN
+    history['count'] = count
+    sensor_data['history'] = history
+
+def temp_log_bounds(file_size, next_slot, count):
+    """Clamp a log header to the records actually on disk (the file may be cut short)"""
+    on_disk = max(0, file_size - TEMP_LOG_HEADER.size) // TEMP_LOG_RECORD.size
+    count = min(count, on_disk, TEMP_HISTORY_MAXLEN)
+    return min(next_slot, count), count
+
+def temp_log_needs_repair(sensor_key):
+    """Check if a sensor's log header claims more records than the file holds"""
+    path = temp_log_path(sensor_key)
+    if not os.path.exists(path):
+        return False
+    
+    size = os.path.getsize(path)
+    if size < TEMP_LOG_HEADER.size:
+        return True
+    
+    with open(path, 'rb') as f:
+        header = TEMP_LOG_HEADER.unpack(f.read(TEMP_LOG_HEADER.size))
+    return temp_log_bounds(size, *header) != header
+
+def read_temp_log(sensor_key):
+    """Read all readings from a sensor's binary log as a record array, oldest first"""
+    path = temp_log_path(sensor_key)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size <= TEMP_LOG_HEADER.size:
+        return np.empty(0, dtype=TEMP_LOG_DTYPE)
+    
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        next_slot, count = temp_log_bounds(size, *TEMP_LOG_HEADER.unpack_from(mm, 0))
+        view = np.frombuffer(mm, dtype=TEMP_LOG_DTYPE, count=count, offset=TEMP_LOG_HEADER.size)
+        stored = view.copy()
+        del view  # Release the mmap buffer before it closes
+    
+    # Once the log has wrapped, the oldest reading sits in the next slot to write
+    if next_slot < count:
+        stored = np.concatenate((stored[next_slot:], stored[:next_slot]))
+    return stored
+
+def open_temp_log(sensor_key):
+    """Open a sensor's binary log for writing, creating it if needed"""
+    path = temp_log_path(sensor_key)
+    # Missing, or cut short before the header was written (e.g. power loss)
+    if not os.path.exists(path) or os.path.getsize(path) < TEMP_LOG_HEADER.size:
+        with open(path, 'wb') as f:
+            f.write(TEMP_LOG_HEADER.pack(0, 0))
+    
+    f = open(path, 'r+b')
+    try:
+        next_slot, count = TEMP_LOG_HEADER.unpack(f.read(TEMP_LOG_HEADER.size))
+    except Exception:
+        f.close()
+        raise
+    
+    # Cut short (e.g. power loss) - carry on after the last complete record
+    on_disk = temp_log_bounds(os.fstat(f.fileno()).st_size, next_slot, count)
+    if on_disk != (next_slot, count):
+        next_slot = count = on_disk[1]
+    temp_log_files[sensor_key] = {'file': f, 'next_slot': next_slot, 'count': count}
+    return temp_log_files[sensor_key]
+
+def append_temp_log(sensor_key, ts_epoch, temp, season_idx):
+    """Write one reading into the next slot of a sensor's binary log"""
+    try:
+        log = temp_log_files.get(sensor_key) or open_temp_log(sensor_key)
+        f = log['file']
+        
+        f.seek(TEMP_LOG_HEADER.size + log['next_slot'] * TEMP_LOG_RECORD.size)
+        f.write(TEMP_LOG_RECORD.pack(ts_epoch, temp, season_idx))
+        
+        log['next_slot'] = (log['next_slot'] + 1) % TEMP_HISTORY_MAXLEN
+        log['count'] = min(log['count'] + 1, TEMP_HISTORY_MAXLEN)
+        f.seek(0)
+        f.write(TEMP_LOG_HEADER.pack(log['next_slot'], log['count']))
+    except Exception as e:
+        print(f"⚠️  Error writing temp log for {sensor_key}: {e}")
+
+def rewrite_temp_log(sensor_key):
+    """Rewrite a sensor's binary log from its in-memory history"""
+    log = temp_log_files.pop(sensor_key, None)
+    if log:
+        log['file'].close()
+    
+    history = temp_sensors[sensor_key]['history']
+    records = temp_history_ordered(history).astype(TEMP_LOG_DTYPE)
+    
+    with open(temp_log_path(sensor_key), 'wb') as f:
+        f.write(TEMP_LOG_HEADER.pack(history['next'], history['count']))
+        f.write(records.tobytes())
+
+def load_temp_pickle_history():
+    """Load temperature history from the old pickle file"""
+    with open(TEMP_HISTORY_FILE, 'rb') as f:
+        data = pickle.load(f)
+    
+    # Single-sensor history (v1.x) belongs to the original ATO sensor
+    if isinstance(data, list):
+        data = {'ato': data}
+    
+    for records in data.values():
+        for record in records:
+            # Older files only stored the ISO timestamp
+            if 'ts_epoch' not in record:
+                record['ts_epoch'] = datetime.fromisoformat(record['timestamp']).timestamp()
+    
+    return data
+
+def load_temp_log(sensor_key, sensor_data):
+    """Load one sensor's history from its binary log, repairing it if cut short"""
+    try:
+        stored = read_temp_log(sensor_key)
+        set_sensor_history(sensor_data, stored['ts'], stored['temp'], stored['season'])
+        if not temp_log_needs_repair(sensor_key):
+            return
+        print(f"⚠️  {sensor_data['name']} temp log was cut short, kept {sensor_data['history']['count']} readings")
+    except Exception as e:
+        print(f"⚠️  Error loading {sensor_data['name']} temp history: {e}")
+        sensor_data['history'] = new_temp_history()
+    
+    # Rewrite the log so later appends match what is in memory
+    try:
+        rewrite_temp_log(sensor_key)
+    except Exception as e:
+        print(f"⚠️  Error rewriting {sensor_data['name']} temp log: {e}")
+
+def load_temp_history():
+    """Load temperature history for all sensors from their binary logs"""
+    try:
+        if any(os.path.exists(temp_log_path(key)) for key in temp_sensors):
+            for sensor_key, sensor_data in temp_sensors.items():
+                load_temp_log(sensor_key, sensor_data)
+        
+        elif os.path.exists(TEMP_HISTORY_FILE):
+            # One-off migration from the pickle history file
+            data = load_temp_pickle_history()
+            for sensor_key, sensor_data in temp_sensors.items():
+                records = data.get(sensor_key, [])
+                set_sensor_history(sensor_data,
+                                   [r['ts_epoch'] for r in records],
+                                   [r['temperature'] for r in records],
+                                   [SEASON_NAMES.index(r['season']) for r in records])
+                rewrite_temp_log(sensor_key)
+            print("✅ Migrated temperature history to binary logs")
+        
+        else:
+            return
+        
+        total = sum(s['history']['count'] for s in temp_sensors.values())
+        print(f"✅ Loaded {total} temperature readings")
+    except Exception as e:
+        print(f"⚠️  Error loading temp history: {e}")
+        for sensor_data in temp_sensors.values():
+            sensor_data['history'] = new_temp_history()
+
+def save_temp_history():
+    """Flush temperature logs to disk (readings are written as they arrive)"""
+    for sensor_key, log in temp_log_files.items():
+        try:
+            log['file'].flush()
+            os.fsync(log['file'].fileno())
+        except Exception as e:
+            print(f"⚠️  Error saving temp history for {sensor_key}: {e}")
+
+# ============================================================================
+# STATE SNAPSHOT (calibration offsets)
+# ============================================================================
+
+STATE_FILE = globals().get('STATE_FILE',
+                           os.path.join(os.path.dirname(TEMP_CALIBRATION_FILE), 'ato_state.msgpack'))
+
+def load_legacy_temp_calibration():
+    """Load calibration offsets from the old pickle file"""
+    with open(TEMP_CALIBRATION_FILE, 'rb') as f:
+        data = pickle.load(f)
+    
+    # Single-sensor calibration (v1.x) belongs to the original ATO sensor
+    return data.get('offsets', {'ato': data.get('offset', 0.0)})
+
+def load_state():
+    """Restore calibration offsets"""
+    try:
+        if os.path.exists(STATE_FILE):
+            with open(STATE_FILE, 'rb') as f:
+                state = msgpack.unpackb(f.read(), raw=False)
+        elif os.path.exists(TEMP_CALIBRATION_FILE):
+            state = {'temp_calibration_offsets': load_legacy_temp_calibration()}
+        else:
+            return
+        
+        offsets = state.get('temp_calibration_offsets', {})
+        for sensor_key, sensor_data in temp_sensors.items():
+            sensor_data['calibration_offset'] = offsets.get(sensor_key, 0.0)
+            print(f"✅ Loaded {sensor_data['name']} calibration offset: {sensor_data['calibration_offset']}°C")
+    except Exception as e:
+        print(f"⚠️  Error loading state: {e}")
+
+def save_state():
+    """Write the state snapshot atomically (temp file + rename)"""
+    state = {
+        'temp_calibration_offsets': {key: s['calibration_offset'] for key, s in temp_sensors.items()}
+    }
+    
+    tmp_path = STATE_FILE + '.tmp'
+    try:
+        data = msgpack.packb(state, use_bin_type=True)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.rename(tmp_path, STATE_FILE)
+    except Exception as e:
+        print(f"⚠️  Error saving state: {e}")
+
+# ============================================================================
+# DEFERRED SAVES (limit SD card writes)
+# ============================================================================
+
+# Seconds between flushes of changed temperature data to disk
+TEMP_FLUSH_INTERVAL = globals().get('TEMP_FLUSH_INTERVAL', 60)
+
+temp_history_dirty = False
+last_temp_flush = time.monotonic()
+
+def flush_temp_data():
+    """Save any changed temperature history to disk"""
+    global temp_history_dirty, last_temp_flush
+    
+    with temp_lock:
+        if temp_history_dirty:
+            save_temp_history()
+            temp_history_dirty = False
+    
+    last_temp_flush = time.monotonic()
+
+def flush_temp_data_if_due():
+    """Flush changed temperature data at most once per TEMP_FLUSH_INTERVAL (call from main loop)"""
+    if temp_history_dirty and time.monotonic() - last_temp_flush >= TEMP_FLUSH_INTERVAL:
+        flush_temp_data()
+
+def handle_sigterm(signum, frame):
+    """Exit cleanly on SIGTERM (systemctl stop) so pending data is flushed"""
+    sys.exit(0)
+
+# Calibration offsets are saved as they change, so only history is pending
+atexit.register(flush_temp_data)
+signal.signal(signal.SIGTERM, handle_sigterm)
+
+# ============================================================================
+# BACKGROUND TEMPERATURE POLLING
+# ============================================================================
+
+# Seconds between temperature reads
+TEMP_READ_INTERVAL = globals().get('TEMP_READ_INTERVAL', 30)
+
+# Readings closer than this to the last recorded one are not recorded or published...
+TEMP_PUBLISH_DELTA_C = globals().get('TEMP_PUBLISH_DELTA_C', 0.1)
+# ...unless this many seconds have passed (keeps history and HA availability fresh)
+TEMP_HEARTBEAT_INTERVAL = globals().get('TEMP_HEARTBEAT_INTERVAL', 300)
+
+last_state_publish = None
+
+def temp_change_significant(sensor_data, now):
+    """Check if a sensor's current reading should be recorded"""
+    if sensor_data['last_recorded_temp'] is None:
+        return True
+    
+    if now - sensor_data['last_recorded_at'] >= TEMP_HEARTBEAT_INTERVAL:
+        return True
+    
+    change = abs(sensor_data['current_temp'] - sensor_data['last_recorded_temp'])
+    return round(change, 2) >= TEMP_PUBLISH_DELTA_C
+
+def temperature_loop():
+    """Read all sensors every TEMP_READ_INTERVAL, recording and publishing changes"""
+    global last_state_publish
+    
+    while True:
+        started = time.monotonic()
+        try:
+            changed = False
+            for sensor_key in read_all_temperatures():
+                sensor_data = temp_sensors[sensor_key]
+                if temp_change_significant(sensor_data, started):
+                    record_temperature(sensor_key, sensor_data['current_temp'])
+                    sensor_data['last_recorded_temp'] = sensor_data['current_temp']
+                    sensor_data['last_recorded_at'] = started
+                    changed = True
+            
+            heartbeat_due = (last_state_publish is None or
+                             started - last_state_publish >= TEMP_HEARTBEAT_INTERVAL)
+            if changed or heartbeat_due:
+                publish_state(force=heartbeat_due)
+                last_state_publish = started
+        except Exception as e:
+            print(f"⚠️  Error reading temperatures: {e}")
+        
+        time.sleep(max(0, TEMP_READ_INTERVAL - (time.monotonic() - started)))
+
+def start_temperature_thread():
+    """Start temperature polling in the background (call once from main)
+    
+    Sensor conversions block for up to 750ms; running them on their own
+    thread keeps float switch and pump handling in the main loop responsive.
+    """
+    thread = threading.Thread(target=temperature_loop, name="temperature", daemon=True)
+    thread.start()
+    return thread
+
 # Continue in next message due to length...
@@ -41,6 +41,27 @@ TEMP_SENSOR_SUMP_NAME = "Sump"
 # If you want auto-detection instead of manual IDs:
 AUTO_DETECT_SENSORS = True  # Set to False to use manual IDs above
 
+# Trigger one conversion on all sensors at once (w1_therm therm_bulk_read,
+# Linux 5.10+). Falls back to per-sensor reads if the bus doesn't support it.
+# Triggering needs write access to sysfs (run as root or add a udev rule);
+# if it can't be written, a warning is logged and per-sensor reads are used
+BULK_READ_ENABLED = True
+
+# Sensor resolution in bits: 12 = 0.0625°C/750ms, 11 = 0.125°C/375ms,
+# 10 = 0.25°C/188ms, 9 = 0.5°C/94ms. 10-bit is plenty for tank monitoring.
+# Writing the resolution needs write access to sysfs (run as root or add a udev rule);
+# if it can't be written, each sensor's actual resolution is read back and used
+DS18B20_RESOLUTION = 10
+
+# Seconds between temperature reads (read in the background)
+TEMP_READ_INTERVAL = 30
+
+# Only record/publish a reading when it moved at least this much (°C) since
+# the last recorded one, or every TEMP_HEARTBEAT_INTERVAL seconds regardless.
+# 0.1 filters single-step flicker at 12-bit (0.0625°C) resolution.
+TEMP_PUBLISH_DELTA_C = 0.1
+TEMP_HEARTBEAT_INTERVAL = 300
+
 # ============================================================================
 # TANK & RESERVOIR CONFIGURATION
 # ============================================================================
@@ -56,6 +77,11 @@ ALERTS_HISTORY_FILE = "/home/pi/ato_alerts_history.pkl"
 PUMP_PERFORMANCE_FILE = "/home/pi/ato_pump_performance.pkl"
 TEMP_HISTORY_FILE = "/home/pi/ato_temp_history.pkl"
 TEMP_CALIBRATION_FILE = "/home/pi/ato_temp_calibration.pkl"
+STATE_FILE = "/home/pi/ato_state.msgpack"  # Calibration offsets
+
+# Changed temperature history/calibration is written to disk at most this
+# often (seconds) to reduce SD card wear. Always flushed on shutdown.
+TEMP_FLUSH_INTERVAL = 60
 
 # ============================================================================
 # ALERT THRESHOLDS